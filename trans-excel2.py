@@ -2,11 +2,18 @@
 # -*- coding: utf-8 -*-
 
 import os
+import sys
 import time
 import argparse
 import json
-import re
 import glob
+import asyncio
+import functools
+import sqlite3
+import shutil
+import zipfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 
 # Check and install required dependencies
@@ -19,16 +26,19 @@ def check_and_install_dependencies():
         if not os.path.exists(req_file):
             print("⚠️ Requirements file not found, creating file...")
             with open(req_file, 'w', encoding='utf-8') as f:
-                f.write("openai>=1.0.0\nxlwings>=0.30.0\npython-dotenv>=1.0.0\npathlib>=1.0.1")
+                f.write("openai>=1.0.0\nxlwings>=0.30.0\nopenpyxl>=3.1.0\nlxml>=4.9.0\npython-dotenv>=1.0.0\ntenacity>=8.2.0\npathlib>=1.0.1")
             print(f"✅ Requirements file created at: {req_file}")
         
         print(f"📋 To install required libraries, run the command:\npip install -r {req_file}")
         
         # Continue importing required libraries
         try:
+            import openpyxl
             import xlwings as xw
-            from openai import OpenAI
+            from lxml import etree
+            from openai import AsyncOpenAI
             from dotenv import load_dotenv
+            import tenacity
             print("✅ All required libraries loaded successfully.")
             return True
         except ImportError as e:
@@ -44,22 +54,56 @@ if not check_and_install_dependencies():
     exit(1)
 
 # Import libraries after checking
+import openpyxl
+import openai
 import xlwings as xw
-from openai import OpenAI
+from lxml import etree
+from openai import AsyncOpenAI
 from dotenv import load_dotenv
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_exponential
+
+# sheet.api / app.api are COM objects only on Windows (appscript objects on macOS)
+_IS_WINDOWS = sys.platform == 'win32'
+
+try:
+    import pythoncom
+    from pywintypes import com_error
+except ImportError:  # pywin32 is only installed on Windows
+    pythoncom = None
+    com_error = Exception
 
 # Load environment variables from .env file
 load_dotenv()
 
 # Initialize API client with Gemini (OpenAI compatible)
-client = OpenAI(
-    base_url="https://generativelanguage.googleapis.com/v1beta/openai/",
-    api_key=os.getenv("GEMINI_API_KEY"),
-)
-
-# Set API delay and batch size
-API_DELAY = 2  # Delay 2 seconds between API calls
+# A new client is created for each event loop because its connection pool is bound to the loop.
+# Retries are handled by _call_api, so the client's own retries are disabled
+def create_client():
+    return AsyncOpenAI(
+        base_url="https://generativelanguage.googleapis.com/v1beta/openai/",
+        api_key=os.getenv("GEMINI_API_KEY"),
+        max_retries=0,
+    )
+
+# Set API rate limit, batch size and concurrency
+API_RPM = 30  # Maximum number of API calls per minute
 BATCH_SIZE = 100  # Maximum number of cells in a batch
+READ_CHUNK_ROWS = 5000  # Maximum number of rows read from a sheet in a single COM call
+ZIP_READ_CHUNK_SIZE = 1024 * 1024  # Bytes decompressed at a time when scanning worksheets of an .xlsx file
+CONCURRENCY = 4  # Maximum number of batches being translated at the same time
+MAX_FILE_WORKERS = 4  # Maximum number of Excel files processed at the same time
+API_MAX_ATTEMPTS = 5  # Maximum number of attempts for an API call failing with a transient error
+
+# Shared string table of an .xlsx file and the elements used inside it
+SHARED_STRINGS_FILE = "xl/sharedStrings.xml"
+_SHEET_NS = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+_XML_SPACE = "{http://www.w3.org/XML/1998/namespace}space"
+
+# Persistent translation cache, keyed by (target language, cleaned source text)
+CACHE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "trans_cache.sqlite")
+_cache = {}
+_cache_conn = None
+_cache_lock = threading.Lock()
 
 def clean_text(text):
     """Clean and normalize text before translation"""
@@ -68,33 +112,240 @@ def clean_text(text):
     text = ' '.join(text.split())  # Normalize whitespace
     return text.strip()
 
-def should_translate(text):
-    """Check if a cell needs translation"""
-    text = clean_text(text)
-    if not text or len(text) < 2:
+# Translation table deleting digits and number formatting characters (including full-width digits),
+# so a text made only of these characters translates to an empty string
+_NUM_CHARS = str.maketrans('', '', '0123456789０１２３４５６７８９ ,.-\t\n')
+_FORMULA_PREFIX = '='
+
+def _is_translatable(text):
+    """Check if an already cleaned text needs translation"""
+    if len(text) < 2:
         return False
-    if re.match(r'^[\d\s,.-]+$', text):  # Contains only numbers and number formatting characters
+    if not text.translate(_NUM_CHARS):  # Contains only numbers and number formatting characters
         return False
-    if text.startswith('='):  # Excel formula
+    if text.startswith(_FORMULA_PREFIX):  # Excel formula
         return False
     return True
 
-def translate_batch(texts, target_lang="ja"):
-    """Translate a batch of texts to the target language (Japanese or Vietnamese)"""
-    if not texts:
-        return []
+def iter_sheet_rows(sheet):
+    """Yield (row number, first column, row values, row formulas) for the used range of a sheet.
+
+    Values are read with Value2 in blocks of READ_CHUNK_ROWS rows, so each COM call
+    returns many rows at once without marshalling the whole sheet in one payload.
+    Value2 skips date conversion, so dates come back as plain numbers. Formulas are
+    read for the same block, since Value2 only holds the computed result.
+    Outside Windows the whole used range is read through xlwings instead.
+    """
+    if not _IS_WINDOWS:
+        used_rng = sheet.used_range
+        first_row, first_col = used_rng.row, used_rng.column
+        values = used_rng.options(ndim=2).value
+        formulas = used_rng.formula
+        if isinstance(formulas, str):  # A single cell returns a scalar
+            formulas = ((formulas,),)
+        for offset, (row, formula_row) in enumerate(zip(values, formulas)):
+            yield first_row + offset, first_col, row, formula_row
+        return
+
+    used_rng = sheet.api.UsedRange
+    first_row, first_col = used_rng.Row, used_rng.Column
+    row_count, col_count = used_rng.Rows.Count, used_rng.Columns.Count
+    last_col = first_col + col_count - 1
+
+    for start in range(first_row, first_row + row_count, READ_CHUNK_ROWS):
+        end = min(start + READ_CHUNK_ROWS, first_row + row_count) - 1
+        block = sheet.api.Range(sheet.api.Cells(start, first_col), sheet.api.Cells(end, last_col))
+        values = block.Value2
+        formulas = block.Formula
+        if not isinstance(values, tuple):  # A single cell returns a scalar
+            values = ((values,),)
+            formulas = ((formulas,),)
+        for offset, (row, formula_row) in enumerate(zip(values, formulas)):
+            yield start + offset, first_col, row, formula_row
+
+def iter_translatable_cells(sheet):
+    """Yield (row, col, cleaned text) for the cells of a sheet that need translation.
+    Only text values can need translation; numbers, dates and booleans clean to an empty string.
+    Formula cells are skipped even when they compute text, so the formula is never overwritten"""
+    for row_num, first_col, row, formula_row in iter_sheet_rows(sheet):
+        for j, (v, formula) in enumerate(zip(row, formula_row)):
+            if v is None or (isinstance(formula, str) and formula.startswith(_FORMULA_PREFIX)):
+                continue
+            if (cleaned := clean_text(v)) and _is_translatable(cleaned):
+                yield row_num, first_col + j, cleaned
+
+def read_shape_text(shape):
+    """Get text from a shape, returns (text, method) where method tags the accessor that worked"""
+    # TextFrame2 covers the text of almost all shapes in Excel 2007+,
+    # the other methods are only tried when it is not supported
+    try:
+        return shape.TextFrame2.TextRange.Text, 'tf2'
+    except (com_error, AttributeError):
+        pass
 
-    # Read system prompt from file
+    # Method 1: TextFrame
+    try:
+        if hasattr(shape, 'TextFrame'):
+            if shape.TextFrame.HasText:
+                return shape.TextFrame.Characters().Text, 'tf'
+    except:
+        pass
+
+    # Method 2: AlternativeText
+    try:
+        if hasattr(shape, 'AlternativeText') and shape.AlternativeText:
+            return shape.AlternativeText, 'alt'
+    except:
+        pass
+
+    # Method 3: OLEFormat (for OLE objects)
+    try:
+        if hasattr(shape, 'OLEFormat') and hasattr(shape.OLEFormat, 'Object'):
+            if hasattr(shape.OLEFormat.Object, 'Text'):
+                return shape.OLEFormat.Object.Text, 'ole'
+    except:
+        pass
+
+    # Method 4: TextEffect (for WordArt)
+    try:
+        if hasattr(shape, 'TextEffect') and hasattr(shape.TextEffect, 'Text'):
+            return shape.TextEffect.Text, 'te'
+    except:
+        pass
+
+    return None, None
+
+# Setters for each method returned by read_shape_text, so text is written back
+# through the same accessor it was read from
+SHAPE_TEXT_SETTERS = {
+    'tf2': lambda shape, text: setattr(shape.TextFrame2.TextRange, 'Text', text),
+    'tf': lambda shape, text: setattr(shape.TextFrame.Characters(), 'Text', text),
+    'alt': lambda shape, text: setattr(shape, 'AlternativeText', text),
+    'ole': lambda shape, text: setattr(shape.OLEFormat.Object, 'Text', text),
+    'te': lambda shape, text: setattr(shape.TextEffect, 'Text', text),
+}
+
+def _get_cache_conn():
+    """Open the translation cache database and load existing entries into memory"""
+    global _cache_conn
+    with _cache_lock:
+        if _cache_conn is None:
+            try:
+                os.makedirs(os.path.dirname(CACHE_FILE), exist_ok=True)
+                # Shared by the file worker threads, writes are serialized with _cache_lock
+                conn = sqlite3.connect(CACHE_FILE, check_same_thread=False)
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS translations ("
+                    "lang TEXT NOT NULL, src TEXT NOT NULL, dst TEXT NOT NULL, "
+                    "PRIMARY KEY (lang, src))"
+                )
+                for lang, src, dst in conn.execute("SELECT lang, src, dst FROM translations"):
+                    _cache[(lang, src)] = dst
+                _cache_conn = conn
+            except sqlite3.Error as e:
+                print(f"⚠️ Translation cache unavailable, continuing without it: {str(e)}")
+                _cache_conn = False
+    return _cache_conn
+
+def get_cached_translation(text, target_lang="ja"):
+    """Return the cached translation of a cleaned text, or None if not cached"""
+    _get_cache_conn()
+    return _cache.get((target_lang, text))
+
+def store_translations(texts, translations, target_lang="ja"):
+    """Save translated texts to the in-memory cache and persist them to disk"""
+    rows = [(target_lang, src, dst) for src, dst in zip(texts, translations)]
+    for lang, src, dst in rows:
+        _cache[(lang, src)] = dst
+
+    conn = _get_cache_conn()
+    if not conn:
+        return
+    try:
+        with _cache_lock:
+            conn.executemany("INSERT OR REPLACE INTO translations (lang, src, dst) VALUES (?, ?, ?)", rows)
+            conn.commit()
+    except sqlite3.Error as e:
+        print(f"⚠️ Could not save translations to cache: {str(e)}")
+
+def _collect_runs(rows, cols, values, vertical):
+    """Collect contiguous runs of cells along rows (or columns if vertical)"""
+    if vertical:
+        order = sorted(range(len(values)), key=lambda k: (cols[k], rows[k]))
+    else:
+        order = sorted(range(len(values)), key=lambda k: (rows[k], cols[k]))
+
+    runs = []
+    for k in order:
+        row, col = rows[k], cols[k]
+        if runs:
+            start_row, start_col, run_values = runs[-1]
+            if vertical:
+                extends = col == start_col and row == start_row + len(run_values)
+            else:
+                extends = row == start_row and col == start_col + len(run_values)
+            if extends:
+                run_values.append(values[k])
+                continue
+        runs.append((row, col, [values[k]]))
+    return runs
+
+def group_contiguous_runs(rows, cols, values):
+    """Group cells given as parallel lists of rows, columns and values into
+    contiguous blocks for bulk writing.
+
+    Returns a list of (row, col, values, vertical) using whichever orientation
+    needs fewer blocks, so a translated column is written in one call.
+    Only translated cells are written; formula cells are skipped when collecting
+    (see iter_translatable_cells), so formulas and other cells stay untouched.
+    """
+    horizontal = _collect_runs(rows, cols, values, vertical=False)
+    vertical = _collect_runs(rows, cols, values, vertical=True)
+    if len(vertical) < len(horizontal):
+        return [(row, col, run_values, True) for row, col, run_values in vertical]
+    return [(row, col, run_values, False) for row, col, run_values in horizontal]
+
+class TokenBucket:
+    """Thread-safe token bucket rate limiter, refilled continuously at refill_rate tokens per second"""
+
+    def __init__(self, capacity, refill_rate):
+        self.capacity = capacity
+        self.refill_rate = refill_rate
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        """Take a token and return how many seconds to wait before using it.
+        The token count may go negative, so later callers queue up behind earlier ones"""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.refill_rate)
+            self.updated = now
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.refill_rate
+
+# Shared by all files and batches. A full bucket allows a burst of one call per concurrent
+# batch, and that burst is taken out of API_RPM: capacity + refill over 60 seconds equals
+# API_RPM, so no 60-second window can see more than API_RPM calls
+_API_BURST = min(CONCURRENCY, API_RPM - 1)
+_api_bucket = TokenBucket(capacity=_API_BURST, refill_rate=(API_RPM - _API_BURST) / 60)
+
+@functools.lru_cache(maxsize=1)
+def _get_system_prompt():
+    """Read the system prompt from file once and reuse it for every batch"""
     script_dir = os.path.dirname(os.path.abspath(__file__))
     prompt_file = os.path.join(script_dir, "trans-excel-system-prompt.txt")
     
     # Check if the prompt file exists
     if os.path.exists(prompt_file):
         with open(prompt_file, 'r', encoding='utf-8') as f:
-            system_prompt = f.read()
-    else:
-        # Use default prompt if file doesn't exist
-        system_prompt = """You are a professional translator. Follow these rules strictly:
+            return f.read()
+
+    # Use default prompt if file doesn't exist
+    system_prompt = """You are a professional translator. Follow these rules strictly:
 1. Output ONLY the translation, nothing else
 2. DO NOT include the original text in your response
 3. DO NOT add any explanations or notes
@@ -104,10 +355,45 @@ def translate_batch(texts, target_lang="ja"):
 7. Use proper grammar and punctuation
 8. Only keep unchanged: proper names, IDs, and technical codes
 9. Translate all segments separated by "|||" and keep them separated with the same delimiter"""
-        # Create default prompt file
-        with open(prompt_file, 'w', encoding='utf-8') as f:
-            f.write(system_prompt)
-        print(f"📝 Default prompt file created at: {prompt_file}")
+    # Create default prompt file
+    with open(prompt_file, 'w', encoding='utf-8') as f:
+        f.write(system_prompt)
+    print(f"📝 Default prompt file created at: {prompt_file}")
+    return system_prompt
+
+def _log_retry(retry_state):
+    """Print a notice before a failed API call is retried"""
+    print(f"   🔁 API call failed ({retry_state.outcome.exception()}), retrying in {retry_state.next_action.sleep:.0f}s "
+          f"(attempt {retry_state.attempt_number + 1}/{API_MAX_ATTEMPTS})")
+
+# Transient errors worth retrying; other API errors (bad request, authentication, ...) fail immediately
+RETRYABLE_API_ERRORS = (openai.RateLimitError, openai.APITimeoutError, openai.APIConnectionError, openai.InternalServerError)
+
+@retry(
+    stop=stop_after_attempt(API_MAX_ATTEMPTS),
+    wait=wait_exponential(multiplier=1, min=2, max=30),
+    retry=retry_if_exception_type(RETRYABLE_API_ERRORS),
+    before_sleep=_log_retry,
+    reraise=True,
+)
+async def _call_api(client, messages):
+    """Call the translation API, retrying transient errors with exponential backoff"""
+    # Wait only if the shared API rate limit has been used up
+    wait = _api_bucket.reserve()
+    if wait:
+        await asyncio.sleep(wait)
+
+    return await client.chat.completions.create(
+        model="gemini-2.0-flash-lite", # Or "gemini-pro" or other suitable model
+        messages=messages
+    )
+
+async def translate_batch(client, texts, target_lang="ja"):
+    """Translate a batch of texts to the target language (Japanese or Vietnamese)"""
+    if not texts:
+        return []
+
+    system_prompt = _get_system_prompt()
 
     # Combine texts with separator
     separator = "|||"
@@ -119,13 +405,10 @@ def translate_batch(texts, target_lang="ja"):
 
     try:
         # Call translation API
-        response = client.chat.completions.create(
-            model="gemini-2.0-flash-lite", # Or "gemini-pro" or other suitable model
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ]
-        )
+        response = await _call_api(client, [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt}
+        ])
 
         # Split translation result into separate parts
         translated_text = response.choices[0].message.content
@@ -139,9 +422,10 @@ def translate_batch(texts, target_lang="ja"):
                 translated_parts.extend(texts[len(translated_parts):])
             else:
                 translated_parts = translated_parts[:len(texts)]
+        else:
+            # Only cache complete results so untranslated fallbacks are never stored
+            store_translations(texts, translated_parts, target_lang)
 
-        # Delay to avoid exceeding API limits
-        time.sleep(API_DELAY)
         return translated_parts
 
     except Exception as e:
@@ -149,6 +433,47 @@ def translate_batch(texts, target_lang="ja"):
         # Return original texts if translation fails
         return texts
 
+async def translate_batches(batches, target_lang="ja"):
+    """Translate batches concurrently, keeping at most CONCURRENCY requests in flight"""
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+    total_batches = len(batches)
+
+    async def run_batch(batch_num, batch_texts):
+        async with semaphore:
+            print(f"   🔄 Translating batch {batch_num}/{total_batches} ({len(batch_texts)} texts)")
+            return await translate_batch(client, batch_texts, target_lang)
+
+    async with create_client() as client:
+        return await asyncio.gather(*(run_batch(num, batch) for num, batch in enumerate(batches, start=1)))
+
+def translate_texts(texts, target_lang="ja"):
+    """Translate a list of texts, using the cache and sending each distinct miss once.
+    Returns translations in the same order as texts"""
+    # Reuse cached translations and only send cache misses to the API
+    translations = [get_cached_translation(text, target_lang) for text in texts]
+    miss_indices = [k for k, translated in enumerate(translations) if translated is None]
+    cache_hits = len(texts) - len(miss_indices)
+    if cache_hits:
+        print(f"   💾 {cache_hits} text segments found in translation cache.")
+
+    # Send each distinct text only once, then scatter results to every occurrence
+    unique_texts = list(dict.fromkeys(texts[k] for k in miss_indices))
+    if unique_texts:
+        total_batches = (len(unique_texts) - 1) // BATCH_SIZE + 1
+        print(f"   📦 Preparing to translate {len(unique_texts)} unique text segments ({len(miss_indices)} total) in {total_batches} batches.")
+
+    batches = [unique_texts[i:i+BATCH_SIZE] for i in range(0, len(unique_texts), BATCH_SIZE)]
+    translated_batches = asyncio.run(translate_batches(batches, target_lang)) if batches else []
+
+    translated_unique = {}
+    for batch_texts, translated_batch in zip(batches, translated_batches):
+        translated_unique.update(zip(batch_texts, translated_batch))
+
+    for k in miss_indices:
+        translations[k] = translated_unique.get(texts[k])
+
+    return translations
+
 def process_excel(input_path, target_lang="ja"):
     """Process Excel file: read, translate and save with original format"""
     try:
@@ -164,243 +489,360 @@ def process_excel(input_path, target_lang="ja"):
 
         print(f"\n🔄 Processing file: {filename}")
 
-        # Open workbook with xlwings to preserve formatting
-        app = xw.App(visible=False)
-        wb = None # Initialize wb
-        try:
-            wb = app.books.open(input_path)
-
-            # Loop through each sheet
-            for sheet in wb.sheets:
-                print(f"📋 Processing sheet: {sheet.name}")
-
-                # Collect data from cells that need translation
-                texts_to_translate = []
-                cell_references = []
-
-                # Scan through used data range
-                used_rng = sheet.used_range
-                if used_rng.count > 1 or used_rng.value is not None: # Only scan if sheet has data
-                    for cell in used_rng:
-                        # Check if cell.value is None before calling str()
-                        cell_value_str = str(cell.value) if cell.value is not None else ""
-                        if cell_value_str and should_translate(cell_value_str):
-                            texts_to_translate.append(clean_text(cell_value_str))
-                            cell_references.append(cell)
-                else:
-                     print(f"   ⚠️ Sheet '{sheet.name}' is empty or has no data.")
-
-                # --- START SHAPES PROCESSING FIX ---
-                # Process shapes with text
-                try:
-                    shapes_collection = sheet.api.Shapes
-                    shapes_count = shapes_collection.Count
-
-                    if shapes_count > 0:
-                        print(f"📊 Sheet '{sheet.name}' has {shapes_count} shapes to check")
+        # Workbooks without shapes, tables or pivot tables don't need Excel at all
+        if ext.lower() == '.xlsx':
+            try:
+                use_excel = needs_excel(input_path)
+                inline_strings = not use_excel and has_inline_strings(input_path)
+            except zipfile.BadZipFile:
+                # Password-protected workbooks are not zip packages, only Excel can open them
+                print("   🔒 File is not a plain .xlsx package (e.g. password-protected), processing with Excel")
+                use_excel = True
+
+            if not use_excel:
+                if not inline_strings:
+                    print("   ⚡ No shapes found, translating the shared string table directly")
+                    return process_shared_strings(input_path, output_path, target_lang)
+                print("   ⚡ No shapes found, processing without Excel")
+                return process_with_openpyxl(input_path, output_path, target_lang)
+
+        return process_with_xlwings(input_path, output_path, target_lang)
 
-                        # Process each shape by index (Excel COM API indexes from 1)
-                        for i in range(1, shapes_count + 1):
-                            shape = None # Initialize to avoid errors if .Item(i) fails
-                            try:
-                                shape = shapes_collection.Item(i)
-                                shape_text = None
-
-                                # --- Try multiple methods to get text from shape ---
-                                
-                                # Method 1: TextFrame
-                                try:
-                                    if hasattr(shape, 'TextFrame'):
-                                        if shape.TextFrame.HasText:
-                                            shape_text = shape.TextFrame.Characters().Text
-                                except:
-                                    pass
-                                
-                                # Method 2: TextFrame2
-                                if not shape_text:
-                                    try:
-                                        if hasattr(shape, 'TextFrame2'):
-                                            shape_text = shape.TextFrame2.TextRange.Text
-                                    except:
-                                        pass
-                                
-                                # Method 3: AlternativeText
-                                if not shape_text:
-                                    try:
-                                        if hasattr(shape, 'AlternativeText') and shape.AlternativeText:
-                                            shape_text = shape.AlternativeText
-                                    except:
-                                        pass
-                                
-                                # Method 4: OLEFormat (for OLE objects)
-                                if not shape_text:
-                                    try:
-                                        if hasattr(shape, 'OLEFormat') and hasattr(shape.OLEFormat, 'Object'):
-                                            if hasattr(shape.OLEFormat.Object, 'Text'):
-                                                shape_text = shape.OLEFormat.Object.Text
-                                    except:
-                                        pass
-                                
-                                # Method 5: TextEffect (for WordArt)
-                                if not shape_text:
-                                    try:
-                                        if hasattr(shape, 'TextEffect') and hasattr(shape.TextEffect, 'Text'):
-                                            shape_text = shape.TextEffect.Text
-                                    except:
-                                        pass
-                                
-                                # If text is found, add to translation list
-                                if shape_text and should_translate(shape_text):
-                                    clean_shape_text = clean_text(shape_text)
-                                    print(f"   💬 Shape {i}: Found text: {clean_shape_text[:30]}...")
-                                    texts_to_translate.append(clean_shape_text)
-                                    
-                                    # Save tuple with information for later updates:
-                                    # ('shape', sheet object, shape index, list of methods tried)
-                                    cell_references.append(('shape', sheet, i))
-
-                            except Exception as outer_e:
-                                # General error when processing shape
-                                print(f"   ⚠️ Error processing shape {i}: {str(outer_e)}")
-                                continue
-
-                except Exception as e:
-                    print(f"   ⚠️ Error processing shapes on sheet '{sheet.name}': {str(e)}")
-                # --- END SHAPES PROCESSING FIX ---
-
-
-                # Split into batches for processing
-                if not texts_to_translate:
-                     print(f"   ✅ No text to translate on sheet '{sheet.name}'.")
-                     continue # Move to next sheet
+    except Exception as e:
+        print(f"❌ Critical error when starting Excel file processing '{input_path}': {str(e)}")
+        return None
 
-                total_batches = (len(texts_to_translate) - 1) // BATCH_SIZE + 1
-                print(f"   📦 Preparing to translate {len(texts_to_translate)} text segments in {total_batches} batches.")
+# Package parts that only Excel keeps consistent when cell text changes: drawings (shapes,
+# charts, images, comments) and tables/pivot caches, whose column names must match header cells
+EXCEL_ONLY_PARTS = ('xl/drawings/', 'xl/tables/', 'xl/pivotCache/')
+
+def needs_excel(input_path):
+    """Check whether an .xlsx file contains parts that must be processed through Excel"""
+    with zipfile.ZipFile(input_path) as z:
+        return any(name.startswith(EXCEL_ONLY_PARTS) for name in z.namelist())
+
+def _stream_contains(stream, marker):
+    """Check whether a binary stream contains marker, reading it in fixed-size chunks"""
+    # Keep the tail of the previous chunk so a marker split across two chunks is still found
+    tail = b""
+    while chunk := stream.read(ZIP_READ_CHUNK_SIZE):
+        window = tail + chunk
+        if marker in window:
+            return True
+        tail = window[-(len(marker) - 1):]
+    return False
+
+def has_inline_strings(input_path):
+    """Check whether any worksheet of an .xlsx file stores text in cells instead of the shared string table"""
+    with zipfile.ZipFile(input_path) as z:
+        for name in z.namelist():
+            if name.startswith('xl/worksheets/') and name.endswith('.xml'):
+                with z.open(name) as sheet_xml:
+                    if _stream_contains(sheet_xml, b'inlineStr'):
+                        return True
+    return False
+
+def _shared_string_text(si):
+    """Get the text of a shared string item, joining rich text runs and skipping phonetic hints"""
+    t = si.find(f'{_SHEET_NS}t')
+    if t is not None:
+        return t.text or ""
+    return "".join(run_t.text or "" for run_t in si.iterfind(f'{_SHEET_NS}r/{_SHEET_NS}t'))
+
+def _set_shared_string_text(si, text):
+    """Replace the text of a shared string item, rich text keeps the formatting of its first run"""
+    t = si.find(f'{_SHEET_NS}t')
+    if t is None:
+        runs = si.findall(f'{_SHEET_NS}r')
+        t = runs[0].find(f'{_SHEET_NS}t')
+        for run in runs[1:]:
+            si.remove(run)
+    t.text = text
+    if text != text.strip():
+        t.set(_XML_SPACE, 'preserve')
+
+    # Phonetic hints (furigana) belong to the original text
+    for rph in si.findall(f'{_SHEET_NS}rPh'):
+        si.remove(rph)
+
+def process_shared_strings(input_path, output_path, target_lang="ja"):
+    """Translate an .xlsx file by rewriting only its shared string table.
+
+    Cells refer to shared strings by index, so worksheets are copied unchanged and
+    each distinct string of the workbook is collected only once.
+    """
+    with zipfile.ZipFile(input_path) as zin:
+        if SHARED_STRINGS_FILE not in zin.namelist():
+            print(f"   📄 Nothing to translate, copying original file to: {output_path}")
+            shutil.copyfile(input_path, output_path)
+            return output_path
+
+        root = etree.fromstring(zin.read(SHARED_STRINGS_FILE))
+
+        # Collect shared strings that need translation
+        string_items = []
+        texts_to_translate = []
+        for si in root.iterfind(f'{_SHEET_NS}si'):
+            cleaned = clean_text(_shared_string_text(si))
+            if cleaned and _is_translatable(cleaned):
+                string_items.append(si)
+                texts_to_translate.append(cleaned)
+
+        if not texts_to_translate:
+            print(f"   📄 Nothing to translate, copying original file to: {output_path}")
+            shutil.copyfile(input_path, output_path)
+            return output_path
+
+        print(f"📋 Found {len(texts_to_translate)} strings to translate in the shared string table")
+        translations = translate_texts(texts_to_translate, target_lang)
+
+        # Update translated content
+        print("   ✍️ Updating shared string table...")
+        for si, source, translated in zip(string_items, texts_to_translate, translations):
+            if translated == source:
+                # Failed batches return the original text: keep rich text runs and furigana as they are
+                continue
+            if translated is not None:
+                _set_shared_string_text(si, translated)
+            else:
+                print(f"   ⚠️ Missing translation for '{_shared_string_text(si)[:30]}'. Keeping original value.")
+        shared_strings = etree.tostring(root, xml_declaration=True, encoding='UTF-8', standalone=True)
+
+        # Copy every other part of the package as is, keeping entry order and compression
+        print(f"\n💾 Saving translated file to: {output_path}")
+        with zipfile.ZipFile(output_path, 'w') as zout:
+            for info in zin.infolist():
+                data = shared_strings if info.filename == SHARED_STRINGS_FILE else zin.read(info)
+                zout.writestr(info, data)
+        print(f"✅ File saved successfully: {output_path}")
+
+    return output_path
+
+def process_with_openpyxl(input_path, output_path, target_lang="ja"):
+    """Translate cells of a workbook with openpyxl, without starting Excel"""
+    wb = openpyxl.load_workbook(input_path)
+    total_translatable = 0
+
+    for ws in wb.worksheets:
+        print(f"📋 Processing sheet: {ws.title}")
+
+        # Collect data from cells that need translation
+        texts_to_translate = []
+        cell_references = []
+        for row in ws.iter_rows():
+            for cell in row:
+                # Formulas are kept as "=..." strings and are skipped by _is_translatable
+                cleaned = clean_text(cell.value)
+                if cleaned and _is_translatable(cleaned):
+                    texts_to_translate.append(cleaned)
+                    cell_references.append(cell)
+
+        if not texts_to_translate:
+            print(f"   ✅ No text to translate on sheet '{ws.title}'.")
+            continue # Move to next sheet
+
+        total_translatable += len(texts_to_translate)
+        translations = translate_texts(texts_to_translate, target_lang)
+
+        # Update translated content
+        print(f"   ✍️ Updating content for sheet '{ws.title}'...")
+        for cell, translated in zip(cell_references, translations):
+            if translated is not None:
+                cell.value = translated
+            else:
+                print(f"   ⚠️ Missing translation for Cell {cell.coordinate}. Keeping original value.")
 
-                for i in range(0, len(texts_to_translate), BATCH_SIZE):
-                    batch_texts = texts_to_translate[i:i+BATCH_SIZE]
-                    batch_refs = cell_references[i:i+BATCH_SIZE]
-                    current_batch_num = i // BATCH_SIZE + 1
+    # Nothing changed, copy the original instead of re-serializing it
+    if total_translatable == 0:
+        print(f"\n📄 Nothing to translate, copying original file to: {output_path}")
+        shutil.copyfile(input_path, output_path)
+        return output_path
 
-                    print(f"   🔄 Translating batch {current_batch_num}/{total_batches} ({len(batch_texts)} texts)")
+    # Save file with original format
+    print(f"\n💾 Saving translated file to: {output_path}")
+    wb.save(output_path)
+    print(f"✅ File saved successfully: {output_path}")
+    return output_path
 
-                    # Translate batch
-                    translated_batch = translate_batch(batch_texts, target_lang)
+def process_with_xlwings(input_path, output_path, target_lang="ja"):
+    """Translate cells and shapes of a workbook through Excel with xlwings"""
+    filename = os.path.basename(input_path)
 
-                    # Update translated content
-                    print(f"   ✍️ Updating content for batch {current_batch_num}...")
-                    for j, ref in enumerate(batch_refs):
-                        # Check if index j is within translated_batch
-                        if j < len(translated_batch) and translated_batch[j] is not None:
+    # Open workbook with xlwings to preserve formatting
+    app = xw.App(visible=False)
+    wb = None # Initialize wb
+    try:
+        # Don't redraw, fire events or show dialogs for every write
+        app.screen_updating = False
+        app.display_alerts = False
+        if _IS_WINDOWS:  # EnableEvents is only reachable through COM
+            app.api.EnableEvents = False
+
+        wb = app.books.open(input_path)
+
+        # Don't recalculate dependent formulas after each write
+        # (calculation mode can only be changed once a workbook is open)
+        original_calculation = app.calculation
+        app.calculation = 'manual'
+
+        total_translatable = 0
+
+        # Loop through each sheet
+        for sheet in wb.sheets:
+            print(f"📋 Processing sheet: {sheet.name}")
+
+            # Collect cells that need translation as parallel columns (row, column, text)
+            # instead of one tuple per cell
+            cell_rows = []
+            cell_cols = []
+            cell_texts = []
+
+            # Scan through used data range, each cell is consumed as soon as it is produced
+            for row_num, col_num, cleaned in iter_translatable_cells(sheet):
+                cell_rows.append(row_num)
+                cell_cols.append(col_num)
+                cell_texts.append(cleaned)
+
+            # Shapes with text: (shape index, shape object, text method) and their texts
+            shape_refs = []
+            shape_texts = []
+
+            # --- START SHAPES PROCESSING FIX ---
+            # Process shapes with text
+            try:
+                # Fetch all shapes through the COM enumerator instead of one Item(i) call per shape
+                shapes = list(sheet.api.Shapes)
+
+                if shapes:
+                    print(f"📊 Sheet '{sheet.name}' has {len(shapes)} shapes to check")
+
+                    # Index follows Excel's shape order (from 1) and is only used for logging
+                    for i, shape in enumerate(shapes, start=1):
+                        try:
+                            shape_text, method = read_shape_text(shape)
+
+                            # If text is found, add to translation list
+                            clean_shape_text = clean_text(shape_text)
+                            if clean_shape_text and _is_translatable(clean_shape_text):
+                                print(f"   💬 Shape {i}: Found text: {clean_shape_text[:30]}...")
+                                shape_texts.append(clean_shape_text)
+                                
+                                # Keep the shape object and the method that found its text,
+                                # so neither has to be looked up again when updating
+                                shape_refs.append((i, shape, method))
+
+                        except Exception as outer_e:
+                            # General error when processing shape
+                            print(f"   ⚠️ Error processing shape {i}: {str(outer_e)}")
+                            continue
+
+            except Exception as e:
+                print(f"   ⚠️ Error processing shapes on sheet '{sheet.name}': {str(e)}")
+            # --- END SHAPES PROCESSING FIX ---
+
+
+            # Split into batches for processing
+            if not cell_texts and not shape_texts:
+                 print(f"   ✅ No text to translate on sheet '{sheet.name}'.")
+                 continue # Move to next sheet
+
+            total_translatable += len(cell_texts) + len(shape_texts)
+            translations = translate_texts(cell_texts + shape_texts, target_lang)
+            cell_translations = translations[:len(cell_texts)]
+            shape_translations = translations[len(cell_texts):]
+
+            # Update translated content
+            print(f"   ✍️ Updating content for sheet '{sheet.name}'...")
+            for (shape_index, shape_to_update, method), translated in zip(shape_refs, shape_translations):
+                if translated is None:
+                    print(f"   ⚠️ Missing translation for shape {shape_index} on sheet '{sheet.name}'. Keeping original value.")
+                    continue
+                try:
+                    SHAPE_TEXT_SETTERS[method](shape_to_update, translated)
+                    print(f"   ✅ Updated text for shape {shape_index} on sheet '{sheet.name}'")
+                except Exception as update_err:
+                    print(f"   ⚠️ Error updating shape {shape_index} on sheet '{sheet.name}': {str(update_err)}")
+
+            # Keep only cells that received a translation
+            write_rows = []
+            write_cols = []
+            write_values = []
+            for row, col, translated in zip(cell_rows, cell_cols, cell_translations):
+                if translated is None:
+                    print(f"   ⚠️ Missing translation for Cell (row {row}, column {col}). Keeping original value.")
+                    continue
+                write_rows.append(row)
+                write_cols.append(col)
+                write_values.append(translated)
+
+            # Write translated cells back as contiguous blocks, one COM call per block
+            if write_values:
+                runs = group_contiguous_runs(write_rows, write_cols, write_values)
+                print(f"   ✍️ Writing {len(write_values)} cells in {len(runs)} blocks...")
+                for row, col, run_values, vertical in runs:
+                    try:
+                        sheet.range((row, col)).options(transpose=vertical).value = run_values
+                    except Exception:
+                        # e.g. a locked cell or merged cells inside the block: write cell by cell
+                        # so only the cells that really fail keep their original value
+                        for k, value in enumerate(run_values):
+                            r, c = (row + k, col) if vertical else (row, col + k)
                             try:
-                                # Update content for shape and cell
-                                if isinstance(ref, tuple) and ref[0] == 'shape':
-                                    # Process shape: ref is ('shape', sheet_obj, shape_index)
-                                    _, sheet_obj, shape_index = ref # Unpack tuple
-                                    try:
-                                        # Get shape object again
-                                        shape_to_update = sheet_obj.api.Shapes.Item(shape_index)
-                                        updated = False
-                                        
-                                        # --- Try multiple methods to update text for shape ---
-                                        
-                                        # Method 1: TextFrame
-                                        try:
-                                            if hasattr(shape_to_update, 'TextFrame') and shape_to_update.TextFrame.HasText:
-                                                shape_to_update.TextFrame.Characters().Text = translated_batch[j]
-                                                updated = True
-                                        except:
-                                            pass
-                                            
-                                        # Method 2: TextFrame2
-                                        if not updated:
-                                            try:
-                                                if hasattr(shape_to_update, 'TextFrame2'):
-                                                    shape_to_update.TextFrame2.TextRange.Text = translated_batch[j]
-                                                    updated = True
-                                            except:
-                                                pass
-                                                
-                                        # Method 3: AlternativeText
-                                        if not updated:
-                                            try:
-                                                if hasattr(shape_to_update, 'AlternativeText'):
-                                                    shape_to_update.AlternativeText = translated_batch[j]
-                                                    updated = True
-                                            except:
-                                                pass
-                                                
-                                        # Method 4: TextEffect (for WordArt)
-                                        if not updated:
-                                            try:
-                                                if hasattr(shape_to_update, 'TextEffect') and hasattr(shape_to_update.TextEffect, 'Text'):
-                                                    shape_to_update.TextEffect.Text = translated_batch[j]
-                                                    updated = True
-                                            except:
-                                                pass
-                                                
-                                        # Method 5: OLEFormat
-                                        if not updated:
-                                            try:
-                                                if hasattr(shape_to_update, 'OLEFormat') and hasattr(shape_to_update.OLEFormat, 'Object'):
-                                                    if hasattr(shape_to_update.OLEFormat.Object, 'Text'):
-                                                        shape_to_update.OLEFormat.Object.Text = translated_batch[j]
-                                                        updated = True
-                                            except:
-                                                pass
-                                                
-                                        if updated:
-                                            print(f"   ✅ Updated text for shape {shape_index} on sheet '{sheet_obj.name}'")
-                                        else:
-                                            print(f"   ⚠️ Could not update text for shape {shape_index} on sheet '{sheet_obj.name}' after trying all methods")
-                                        
-                                    except Exception as update_err:
-                                        print(f"   ⚠️ Error updating shape {shape_index} on sheet '{sheet_obj.name}': {str(update_err)}")
-                                elif isinstance(ref, xw.main.Range):
-                                    # Is a cell
-                                    ref.value = translated_batch[j]
-                                else:
-                                    print(f"   ⚠️ Unknown reference type: {type(ref)}")
-
-                            except Exception as update_single_err:
-                                # Catch general errors when updating a specific cell/shape
-                                ref_info = f"Shape index {ref[2]} on sheet {ref[1].name}" if isinstance(ref, tuple) else f"Cell {ref.address}"
-                                print(f"   ⚠️ Could not update content for {ref_info}: {str(update_single_err)}")
-                        else:
-                            # Notify if a translation is missing for a reference
-                            ref_info = f"Shape index {ref[2]} on sheet {ref[1].name}" if isinstance(ref, tuple) else f"Cell {ref.address}"
-                            print(f"   ⚠️ Missing translation for {ref_info} (index {j} in batch). Keeping original value.")
-
-
-            # Save file with original format
-            print(f"\n💾 Saving translated file to: {output_path}")
-            wb.save(output_path)
-            print(f"✅ File saved successfully: {output_path}")
-
-        except Exception as wb_process_err:
-             print(f"❌ Error processing workbook '{filename}': {str(wb_process_err)}")
-             # Ensure workbook is closed if error occurs before saving
-             if wb is not None:
-                 try:
-                     wb.close()
-                 except Exception as close_err:
-                     print(f"   ⚠️ Error trying to close workbook after processing error: {close_err}")
-        finally:
-            # Close workbook (if not already closed) and Excel app
-            # wb.close() has been called in the except block if needed
-            # Just need to ensure app is closed
-            if 'app' in locals() and app.pid: # Check if app exists and is still running
-                 app.quit()
-                 print("   🔌 Excel application closed.")
-
-        return output_path
-
-    except Exception as e:
-        print(f"❌ Critical error when starting Excel file processing '{input_path}': {str(e)}")
-        # Ensure Excel app is closed if error occurs right at the beginning
-        if 'app' in locals() and app.pid:
-            app.quit()
-        return None
+                                sheet.range((r, c)).value = value
+                            except Exception as write_err:
+                                print(f"   ⚠️ Could not update content for Cell (row {r}, column {c}): {str(write_err)}")
+
+        # Nothing changed, copy the original instead of having Excel save it again
+        if total_translatable == 0:
+            print(f"\n📄 Nothing to translate, copying original file to: {output_path}")
+            wb.close()
+            shutil.copyfile(input_path, output_path)
+            return output_path
+
+        # Restore calculation mode before saving, since it is stored in the workbook
+        app.calculation = original_calculation
+
+        # Save file with original format
+        print(f"\n💾 Saving translated file to: {output_path}")
+        wb.save(output_path)
+        print(f"✅ File saved successfully: {output_path}")
+
+    except Exception as wb_process_err:
+         print(f"❌ Error processing workbook '{filename}': {str(wb_process_err)}")
+         # Ensure workbook is closed if error occurs before saving
+         if wb is not None:
+             try:
+                 wb.close()
+             except Exception as close_err:
+                 print(f"   ⚠️ Error trying to close workbook after processing error: {close_err}")
+         # Nothing was saved, report the file as failed
+         return None
+    finally:
+        # Close workbook (if not already closed) and Excel app
+        # wb.close() has been called in the except block if needed
+        # Just need to ensure app is closed
+        if app.pid: # Check if app is still running
+             try:
+                 app.screen_updating = True
+                 app.display_alerts = True
+                 if _IS_WINDOWS:
+                     app.api.EnableEvents = True
+             except Exception as restore_err:
+                 print(f"   ⚠️ Error restoring Excel settings: {restore_err}")
+             app.quit()
+             print("   🔌 Excel application closed.")
+
+    return output_path
+
+def process_excel_in_thread(input_path, target_lang="ja"):
+    """Run process_excel in a worker thread, each thread needs COM initialized to start its own Excel"""
+    if pythoncom is not None:
+        pythoncom.CoInitialize()
+    try:
+        return process_excel(input_path, target_lang)
+    finally:
+        if pythoncom is not None:
+            pythoncom.CoUninitialize()
 
 def process_directory(input_dir, target_lang="ja"):
     """Process all Excel files in the input directory"""
@@ -419,20 +861,32 @@ def process_directory(input_dir, target_lang="ja"):
 
     print(f"🔍 Found {len(excel_files)} Excel files in input directory: {input_dir}")
 
-    # Process each file
-    successful_files = []
-    failed_files = []
+    # Skip Excel temporary files (usually starting with ~$)
+    files_to_process = []
     for file_path in excel_files:
-        # Skip Excel temporary files (usually starting with ~$)
         if os.path.basename(file_path).startswith('~$'):
             print(f"   ⏩ Skipping temporary file: {os.path.basename(file_path)}")
             continue
+        files_to_process.append(file_path)
 
-        output_file = process_excel(file_path, target_lang)
-        if output_file:
-            successful_files.append(os.path.basename(file_path))
-        else:
-            failed_files.append(os.path.basename(file_path))
+    # Process files in parallel, most of the time per file is spent waiting for the API
+    successful_files = []
+    failed_files = []
+    if files_to_process:
+        with ThreadPoolExecutor(max_workers=min(MAX_FILE_WORKERS, len(files_to_process))) as executor:
+            futures = {executor.submit(process_excel_in_thread, file_path, target_lang): file_path
+                       for file_path in files_to_process}
+            for future in as_completed(futures):
+                file_path = futures[future]
+                try:
+                    output_file = future.result()
+                except Exception as e:
+                    print(f"❌ Unexpected error processing '{os.path.basename(file_path)}': {str(e)}")
+                    output_file = None
+                if output_file:
+                    successful_files.append(os.path.basename(file_path))
+                else:
+                    failed_files.append(os.path.basename(file_path))
 
     print("\n--- Directory processing completed ---")
     print(f"✅ Successful: {len(successful_files)} files")
@@ -461,6 +915,10 @@ def main():
     os.makedirs(output_dir, exist_ok=True)
     print(f"📂 Output directory: {output_dir}")
 
+    # The API client is only created when translating, so check the key before processing any file
+    if not os.getenv("GEMINI_API_KEY"):
+        print("❌ GEMINI_API_KEY is not set. Add it to the .env file (see .env.sample) and try again.")
+        return
 
     print(f"🎯 Target language: {'Japanese' if args.to == 'ja' else 'Vietnamese'}")
     # Process all files in the input directory